@@ -1,9 +1,32 @@
 """Helper functions for geocoding and coordinate conversions."""
 
-from builtins import enumerate
-import requests
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import json
 
+import numpy as np
+
+from nimbletl.utilities import requests_session
+
+
+_BAG_URL = "https://basisregistraties.arcgisonline.nl/arcgis/rest/services/BAG/BAGv2/MapServer/0/query"
+_BAG_PARAMS = {
+    "geometryType": "esriGeometryEnvelope",
+    "spatialRel": "esriSpatialRelIntersects",
+    "returnGeometry": "true",
+    "returnTrueCurves": "false",
+    "outSR": "28992",
+    "returnIdsOnly": "false",
+    "returnCountOnly": "false",
+    "returnZ": "false",
+    "returnM": "false",
+    "returnDistinctValues": "false",
+    "returnExtentOnly": "false",
+    "featureEncoding": "esriDefault",
+    "f": "pjson",
+}
+_SESSION = requests_session()
+
 
 def get_RDXY(postcode, huisnummer):
     """
@@ -13,14 +36,84 @@ def get_RDXY(postcode, huisnummer):
     huisnmmmer: house number, without any additions
 
     https://basisregistraties.arcgisonline.nl/arcgis/rest/services/BAG/
+
+    Results are cached per normalized address, so repeated lookups don't hit the API again.
+    """
+    return _fetch_RDXY(postcode.upper().replace(" ", ""), int(huisnummer))
+
+
+@lru_cache(maxsize=100_000)
+def _fetch_RDXY(postcode, huisnummer):
+    """Uncached BAG lookup behind `get_RDXY`."""
+    params = {**_BAG_PARAMS, "where": f"huisnummer='{huisnummer}' AND postcode='{postcode}'"}
+    features = _query_BAG(params)["features"]
+    return features[0]["geometry"] if features else None
+
+
+def _query_BAG(params):
+    """
+    Queries BAG and returns the parsed response.
+
+    ArcGIS reports errors, e.g. throttling, as HTTP 200 with an "error" body. These are
+    raised, so that callers (and `lru_cache`) don't mistake them for addresses not found.
     """
+    response = _SESSION.get(_BAG_URL, params=params, timeout=30)
+    response.raise_for_status()
+    payload = response.json()
+    if "error" in payload:
+        raise RuntimeError(f"BAG query failed: {payload['error']}")
+    return payload
 
-    URL = f"https://basisregistraties.arcgisonline.nl/arcgis/rest/services/BAG/BAGv2/MapServer/0/query?where=huisnummer%3D%27{huisnummer}%27+AND+postcode+%3D+%27{postcode}%27&text=&objectIds=&time=&geometry=&geometryType=esriGeometryEnvelope&inSR=&spatialRel=esriSpatialRelIntersects&relationParam=&outFields=&returnGeometry=true&returnTrueCurves=false&maxAllowableOffset=&geometryPrecision=&outSR=28992&having=&returnIdsOnly=false&returnCountOnly=false&orderByFields=&groupByFieldsForStatistics=&outStatistics=&returnZ=false&returnM=false&gdbVersion=&historicMoment=&returnDistinctValues=false&resultOffset=&resultRecordCount=&queryByDistance=&returnExtentOnly=false&datumTransformation=&parameterValues=&rangeValues=&quantizationParameters=&featureEncoding=esriDefault&f=pjson"
-    get_ = requests.get(URL.format(postcode=postcode, huisnummer=str(huisnummer)))
-    try:
-        return get_.json()["features"][0]["geometry"]
-    except (KeyError, IndexError):
-        return None
+
+def get_RDXY_bulk(addresses, batch_size=50, max_workers=8):
+    """
+    Fetches X, Y Rijksdriehoek coordinates from BAG for many addresses at once.
+
+    Addresses are queried in batches with a single `where` clause per request, and batches
+    are fetched concurrently over a shared session.
+
+    addresses:   iterable of (postcode, huisnummer) tuples, as in `get_RDXY`
+    batch_size:  number of addresses per request
+    max_workers: number of concurrent requests
+
+    Returns dict {(postcode, huisnummer): geometry}, with normalized keys and None for
+    addresses that were not found.
+    """
+    keys = list(
+        dict.fromkeys(
+            (postcode.upper().replace(" ", ""), int(huisnummer))
+            for postcode, huisnummer in addresses
+        )
+    )
+    batches = [keys[i : i + batch_size] for i in range(0, len(keys), batch_size)]
+    result = dict.fromkeys(keys)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for features in executor.map(_fetch_RDXY_batch, batches):
+            for feature in features:
+                attributes = feature["attributes"]
+                key = (attributes["postcode"], int(attributes["huisnummer"]))
+                if key in result and result[key] is None:
+                    result[key] = feature["geometry"]
+
+    return result
+
+
+def _fetch_RDXY_batch(batch):
+    """BAG lookup of one batch of normalized addresses for `get_RDXY_bulk`."""
+    where = " OR ".join(
+        f"(huisnummer='{huisnummer}' AND postcode='{postcode}')"
+        for postcode, huisnummer in batch
+    )
+    params = {**_BAG_PARAMS, "where": where, "outFields": "postcode,huisnummer"}
+    payload = _query_BAG(params)
+    if payload.get("exceededTransferLimit") and len(batch) > 1:
+        # One huisnummer may match several features (huisletter, toevoeging), so a batch
+        # can exceed the server's record limit --> split it until all addresses fit.
+        # A single address only needs its first feature, so that one is never split.
+        half = len(batch) // 2
+        return _fetch_RDXY_batch(batch[:half]) + _fetch_RDXY_batch(batch[half:])
+    return payload["features"]
 
 
 # Can't access API reference, so don't know how to code proper POST request
@@ -39,6 +132,82 @@ def get_RDXY(postcode, huisnummer):
 # print(response.json())
 
 
+def _coefficient_table(p, q, pq):
+    """
+    Scatters sparse polynomial coefficients into a dense table, such that
+    table[p[i]][q[i]] = pq[i].
+    """
+    table = np.zeros((p.max() + 1, q.max() + 1), dtype=np.float64)
+    table[p, q] = pq
+    return table
+
+
+def _estrin_source(coefficients, v):
+    """
+    Returns source of the polynomial sum(coefficients[i] * v**i) in Estrin's scheme, which
+    splits Horner's serial dependency chain into independent pairs (a + b*v) that the CPU
+    can evaluate in parallel. Coefficients are source strings, or None for zero terms, and
+    v**(2**k) is expected to be available as f"{v}{2**k}".
+    """
+    terms = list(coefficients)
+    power = 1
+    while len(terms) > 1:
+        name = v if power == 1 else f"{v}{power}"
+        pairs = []
+        for i in range(0, len(terms), 2):
+            low = terms[i]
+            high = terms[i + 1] if i + 1 < len(terms) else None
+            if high is None:
+                pairs.append(low)
+            elif low is None:
+                pairs.append(f"{name} * ({high})")
+            else:
+                pairs.append(f"({low}) + {name} * ({high})")
+        terms = pairs
+        power *= 2
+    return terms[0]
+
+
+def _compile_conversion(name, inputs, variables, tables, offsets, divisor=1.0):
+    """
+    Generates and JIT-compiles straight-line function name(*inputs) with all constants
+    inlined. The function computes the polynomial variables x, y from the inputs, and returns
+    offset + sum(table[p][q] * x**p * y**q) / divisor for each table and offset. Powers of
+    x and y are computed once and shared by all tables.
+
+    variables: dict {name: source} for x and y, in that order
+    """
+    (x, x_source), (y, y_source) = variables.items()
+    lines = [f"def {name}({', '.join(inputs)}):", f"    {x} = {x_source}", f"    {y} = {y_source}"]
+    for v, n in ((x, max(t.shape[0] for t in tables)), (y, max(t.shape[1] for t in tables))):
+        power = 2
+        while power < n:
+            previous = v if power == 2 else f"{v}{power // 2}"
+            lines.append(f"    {v}{power} = {previous} * {previous}")
+            power *= 2
+    series = [
+        _estrin_source(
+            [
+                _estrin_source([repr(float(c)) if c else None for c in row], y)
+                for row in table
+            ],
+            x,
+        )
+        or "0.0"
+        for table in tables
+    ]
+    scale = "" if divisor == 1 else f" / {float(divisor)!r}"
+    lines.append(
+        "    return "
+        + ", ".join(f"{float(o)!r} + ({s}){scale}" for o, s in zip(offsets, series))
+    )
+
+    from numba import njit
+
+    namespace = {}
+    exec("\n".join(lines), namespace)
+    return njit(fastmath=True)(namespace[name])
+
 
 class RDWGS84Converter(object):
     """
@@ -58,115 +227,159 @@ class RDWGS84Converter(object):
     lam0 = 5.38720621
 
     # Coefficients or the conversion from RD to WGS84
-    Kp = [0, 2, 0, 2, 0, 2, 1, 4, 2, 4, 1]
-    Kq = [1, 0, 2, 1, 3, 2, 0, 0, 3, 1, 1]
-    Kpq = [
-        3235.65389,
-        -32.58297,
-        -0.24750,
-        -0.84978,
-        -0.06550,
-        -0.01709,
-        -0.00738,
-        0.00530,
-        -0.00039,
-        0.00033,
-        -0.00012,
-    ]
+    Kp = np.array([0, 2, 0, 2, 0, 2, 1, 4, 2, 4, 1], dtype=np.int8)
+    Kq = np.array([1, 0, 2, 1, 3, 2, 0, 0, 3, 1, 1], dtype=np.int8)
+    Kpq = np.array(
+        [
+            3235.65389,
+            -32.58297,
+            -0.24750,
+            -0.84978,
+            -0.06550,
+            -0.01709,
+            -0.00738,
+            0.00530,
+            -0.00039,
+            0.00033,
+            -0.00012,
+        ],
+        dtype=np.float64,
+    )
 
-    Lp = [1, 1, 1, 3, 1, 3, 0, 3, 1, 0, 2, 5]
-    Lq = [0, 1, 2, 0, 3, 1, 1, 2, 4, 2, 0, 0]
-    Lpq = [
-        5260.52916,
-        105.94684,
-        2.45656,
-        -0.81885,
-        0.05594,
-        -0.05607,
-        0.01199,
-        -0.00256,
-        0.00128,
-        0.00022,
-        -0.00022,
-        0.00026,
-    ]
+    Lp = np.array([1, 1, 1, 3, 1, 3, 0, 3, 1, 0, 2, 5], dtype=np.int8)
+    Lq = np.array([0, 1, 2, 0, 3, 1, 1, 2, 4, 2, 0, 0], dtype=np.int8)
+    Lpq = np.array(
+        [
+            5260.52916,
+            105.94684,
+            2.45656,
+            -0.81885,
+            0.05594,
+            -0.05607,
+            0.01199,
+            -0.00256,
+            0.00128,
+            0.00022,
+            -0.00022,
+            0.00026,
+        ],
+        dtype=np.float64,
+    )
     # Coefficients for the conversion from WGS84 to RD
-    Rp = [0, 1, 2, 0, 1, 3, 1, 0, 2]
-    Rq = [1, 1, 1, 3, 0, 1, 3, 2, 3]
-    Rpq = [
-        190094.945,
-        -11832.228,
-        -114.221,
-        -32.391,
-        -0.705,
-        -2.340,
-        -0.608,
-        -0.008,
-        0.148,
-    ]
+    Rp = np.array([0, 1, 2, 0, 1, 3, 1, 0, 2], dtype=np.int8)
+    Rq = np.array([1, 1, 1, 3, 0, 1, 3, 2, 3], dtype=np.int8)
+    Rpq = np.array(
+        [
+            190094.945,
+            -11832.228,
+            -114.221,
+            -32.391,
+            -0.705,
+            -2.340,
+            -0.608,
+            -0.008,
+            0.148,
+        ],
+        dtype=np.float64,
+    )
 
-    Sp = [1, 0, 2, 1, 3, 0, 2, 1, 0, 1]
-    Sq = [0, 2, 0, 2, 0, 1, 2, 1, 4, 4]
-    Spq = [
-        309056.544,
-        3638.893,
-        73.077,
-        -157.984,
-        59.788,
-        0.433,
-        -6.439,
-        -0.032,
-        0.092,
-        -0.054,
-    ]
+    Sp = np.array([1, 0, 2, 1, 3, 0, 2, 1, 0, 1], dtype=np.int8)
+    Sq = np.array([0, 2, 0, 2, 0, 1, 2, 1, 4, 4], dtype=np.int8)
+    Spq = np.array(
+        [
+            309056.544,
+            3638.893,
+            73.077,
+            -157.984,
+            59.788,
+            0.433,
+            -6.439,
+            -0.032,
+            0.092,
+            -0.054,
+        ],
+        dtype=np.float64,
+    )
+
+    # Dense coefficient tables [p][q], from which the conversion functions are generated
+    K = _coefficient_table(Kp, Kq, Kpq)
+    L = _coefficient_table(Lp, Lq, Lpq)
+    R = _coefficient_table(Rp, Rq, Rpq)
+    S = _coefficient_table(Sp, Sq, Spq)
 
     def from_rd(self, x: int, y: int) -> tuple:
         """
         Converts RD coordinates into WGS84 coordinates
         """
-        dx = 1e-5 * (x - self.x0)
-        dy = 1e-5 * (y - self.y0)
-        latitude = (
-            self.phi0
-            + sum(
-                [
-                    v * dx ** self.Kp[i] * dy ** self.Kq[i]
-                    for i, v in enumerate(self.Kpq)
-                ]
-            )
-            / 3600
-        )
-        longitude = (
-            self.lam0
-            + sum(
-                [
-                    v * dx ** self.Lp[i] * dy ** self.Lq[i]
-                    for i, v in enumerate(self.Lpq)
-                ]
-            )
-            / 3600
-        )
+        return _conversions()["from_rd"](x, y)
 
-        return latitude, longitude
+    def from_rd_array(self, x: np.ndarray, y: np.ndarray) -> tuple:
+        """
+        Converts arrays of RD coordinates into arrays of WGS84 coordinates
+        """
+        conversions = _conversions()
+        return conversions["rd_to_lat"](x, y), conversions["rd_to_lon"](x, y)
 
     # https://github.com/thomasvnl/rd-to-wgs84
     def from_wgs84(self, latitude: float, longitude: float) -> tuple:
         """
         Converts WGS84 coordinates into RD coordinates
         """
-        dlat = 0.36 * (latitude - self.phi0)
-        dlon = 0.36 * (longitude - self.lam0)
-        x = self.x0 + sum(
-            [
-                v * dlat ** self.Rp[i] * dlon ** self.Rq[i]
-                for i, v in enumerate(self.Rpq)
-            ]
-        )
-        y = self.y0 + sum(
-            [
-                v * dlat ** self.Sp[i] * dlon ** self.Sq[i]
-                for i, v in enumerate(self.Spq)
-            ]
+        return _conversions()["from_wgs84"](latitude, longitude)
+
+    def from_wgs84_array(self, latitude: np.ndarray, longitude: np.ndarray) -> tuple:
+        """
+        Converts arrays of WGS84 coordinates into arrays of RD coordinates
+        """
+        conversions = _conversions()
+        return (
+            conversions["wgs84_to_x"](latitude, longitude),
+            conversions["wgs84_to_y"](latitude, longitude),
         )
 
-        return x, y
+
+@lru_cache(maxsize=None)
+def _conversions():
+    """
+    Generates and compiles the conversions on first use, with the class constants inlined.
+    Importing numba and compiling take about a second, which callers that only geocode
+    shouldn't pay at import.
+
+    Returns dict with the scalar functions from_rd and from_wgs84, and parallel ufuncs
+    rd_to_lat, rd_to_lon, wgs84_to_x and wgs84_to_y.
+    """
+    from numba import float64, vectorize
+
+    from_rd = _compile_conversion(
+        "_from_rd",
+        ("x", "y"),
+        {
+            "dx": f"1e-5 * (x - {RDWGS84Converter.x0!r})",
+            "dy": f"1e-5 * (y - {RDWGS84Converter.y0!r})",
+        },
+        (RDWGS84Converter.K, RDWGS84Converter.L),
+        (RDWGS84Converter.phi0, RDWGS84Converter.lam0),
+        divisor=3600,
+    )
+    from_wgs84 = _compile_conversion(
+        "_from_wgs84",
+        ("latitude", "longitude"),
+        {
+            "dlat": f"0.36 * (latitude - {RDWGS84Converter.phi0!r})",
+            "dlon": f"0.36 * (longitude - {RDWGS84Converter.lam0!r})",
+        },
+        (RDWGS84Converter.R, RDWGS84Converter.S),
+        (RDWGS84Converter.x0, RDWGS84Converter.y0),
+    )
+
+    # Parallel ufuncs fuse shift, polynomial and scaling in a single pass over the input
+    # arrays, without the temporary arrays of an element-wise NumPy implementation
+    ufunc = vectorize([float64(float64, float64)], target="parallel", fastmath=True)
+    return {
+        "from_rd": from_rd,
+        "from_wgs84": from_wgs84,
+        "rd_to_lat": ufunc(lambda x, y: from_rd(x, y)[0]),
+        "rd_to_lon": ufunc(lambda x, y: from_rd(x, y)[1]),
+        "wgs84_to_x": ufunc(lambda latitude, longitude: from_wgs84(latitude, longitude)[0]),
+        "wgs84_to_y": ufunc(lambda latitude, longitude: from_wgs84(latitude, longitude)[1]),
+    }
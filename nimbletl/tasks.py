@@ -8,35 +8,76 @@ Use `prefect.task` to a function into a task in your dataflow pipeline, for exam
 
 """
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import datetime
+from functools import lru_cache
+from itertools import islice
+import io
+import mmap
+import os
 from pathlib import Path
-import requests
-from typing import Union, Any
-from zipfile import ZipFile
-
+from queue import Full, Queue
+import shutil
+import struct
+from typing import Any, List, Union
+from zipfile import ZIP_DEFLATED, ZIP_STORED, BadZipFile, ZipFile
+import zlib
+
+import deflate
+import orjson
 import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.fs
 import pyarrow.parquet as pq
 import re
-from time import sleep
+from tempfile import TemporaryFile
+from threading import Event, Thread
 
+from google.auth.transport.requests import Request
 from google.cloud import bigquery
-from google.cloud import storage
-import pandas as pd
 import prefect
 from prefect import task
 from prefect.utilities.tasks import defaults_from_attrs
 from prefect.tasks.gcp.bigquery import BigQueryLoadFile
+from prefect.engine.cache_validators import all_inputs
 from prefect.engine.signals import SKIP
 from prefect.tasks.shell import ShellTask
 from prefect.tasks.templates import StringFormatter
 from prefect.triggers import all_successful
 from prefect.engine.results import PrefectResult
-
-from nimbletl.utilities import clean_python_name
+from python_calamine import CalamineWorkbook
+
+from nimbletl.utilities import clean_python_names, requests_session
+
+
+_SESSION = requests_session()
+_COPY_BUFSIZE = 4 * 1024 * 1024
+_ROW_GROUP_ROWS = 1_000_000
+_ROW_GROUP_BYTES = 128 * 1024 * 1024
+_EXCEL_CHUNK_ROWS = 50_000
+# Deflated zip members up to this (uncompressed) size are inflated in memory at once
+_INFLATE_ONESHOT_SIZE = 64 * 1024 * 1024
+_DATASET_ID_RE = re.compile(r"[._]")
+# Arrow types of the Datatype of topics in CBS DataProperties
+_CBS_DATATYPES = {
+    "Double": pa.float64(),
+    "Float": pa.float64(),
+    "Long": pa.int64(),
+    "Integer": pa.int64(),
+    "Short": pa.int64(),
+    "String": pa.string(),
+}
 
 
 @task
-def curl_cmd(url: str, filepath: Union[str, Path], **kwargs) -> str:
+def curl_cmd(
+    url: str,
+    filepath: Union[str, Path],
+    conditional: bool = False,
+    skip_if_exists: bool = True,
+    **kwargs,
+) -> str:
     """Template for curl command to download file.
 
     Uses `curl -fL -o` that fails silently and follows redirects. 
@@ -61,114 +102,550 @@ def curl_cmd(url: str, filepath: Union[str, Path], **kwargs) -> str:
     Args:
         - url (str): url to download
         - file (str): file for saving fecthed url
+        - conditional (bool): don't skip existing files, but only download them again if
+            changed upstream, using the ETag (stored next to filepath) and modification time
+        - skip_if_exists (bool): check whether filepath exists, set to False to save the stat
+            call when the caller already knows it doesn't
         - **kwargs: passed to Task constructor
     
     Returns:
         str: curl command
     
     Raises:
-        - SKIP: if filepath exists
+        - SKIP: if filepath exists, `skip_if_exists` is True and `conditional` is False
     """
-    if Path(filepath).exists():
+    if skip_if_exists and not conditional and Path(filepath).exists():
         raise SKIP(f"File {filepath} already exists.")
-    return f"curl -fL -o {filepath} {url}"
+    return f"curl -fL {_curl_conditions(filepath, conditional)}-o {filepath} {url}"
+
+
+@task
+def curl_many_cmd(
+    urls: List[str],
+    filepaths: List[Union[str, Path]],
+    conditional: bool = False,
+    parallel_max: int = 8,
+    **kwargs,
+) -> str:
+    """Template for single curl command to download many files in parallel.
+
+    Uses `curl --parallel` so that all transfers share one process and its connection pool,
+    with the same options as `curl_cmd` per file (separated by `--next`).
+
+    Args:
+        - urls (list): urls to download
+        - filepaths (list): files for saving fetched urls, in the same order as urls
+        - conditional (bool): see `curl_cmd`
+        - parallel_max (int): maximum number of concurrent transfers
+        - **kwargs: passed to Task constructor
+
+    Returns:
+        str: curl command
+
+    Raises:
+        - SKIP: if all filepaths exist and `conditional` is False
+    """
+    targets = [
+        (url, filepath)
+        for url, filepath in zip(urls, filepaths)
+        if conditional or not Path(filepath).exists()
+    ]
+    if not targets:
+        raise SKIP("All files already exist.")
+    transfers = " --next ".join(
+        f"-fL {_curl_conditions(filepath, conditional)}-o {filepath} {url}"
+        for url, filepath in targets
+    )
+    return f"curl --parallel --parallel-max {parallel_max} {transfers}"
+
+
+@task
+def download(
+    urls: List[str], filepaths: List[Union[str, Path]], max_workers: int = 8, **kwargs
+) -> List[Path]:
+    """Downloads many files concurrently in this process, without spawning curl.
+
+    Transfers share the pooled `requests` session, so TCP/TLS connections are reused across
+    files on the same host. Responses are streamed to disk in chunks.
+
+    Args:
+        - urls (list): urls to download
+        - filepaths (list): files for saving fetched urls, in the same order as urls
+        - max_workers (int): maximum number of concurrent transfers
+        - **kwargs: passed to Task constructor
+
+    Returns:
+        - list: Paths of downloaded files
+
+    Raises:
+        - SKIP: if all filepaths exist
+    """
+    targets = [
+        (url, Path(filepath))
+        for url, filepath in zip(urls, filepaths)
+        if not Path(filepath).exists()
+    ]
+    if not targets:
+        raise SKIP("All files already exist.")
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(targets))) as executor:
+        return list(executor.map(lambda target: _download_file(*target), targets))
+
+
+def _download_file(url, filepath):
+    """Streams url to filepath, via a partial file so failed transfers leave nothing behind."""
+    partial = filepath.with_name(f"{filepath.name}.part")
+    try:
+        with _SESSION.get(url, stream=True, timeout=30) as response:
+            response.raise_for_status()
+            with open(partial, "wb") as f:
+                for chunk in response.iter_content(chunk_size=_COPY_BUFSIZE):
+                    f.write(chunk)
+        partial.replace(filepath)
+    except BaseException:
+        partial.unlink(missing_ok=True)
+        raise
+    return filepath
+
+
+def _curl_conditions(filepath, conditional):
+    """curl options for only downloading filepath again if changed upstream."""
+    if not conditional:
+        return ""
+    etag = f"{filepath}.etag"
+    options = f"--etag-save {etag} "
+    if Path(filepath).exists():
+        # If-Modified-Since from file mtime, If-None-Match from previous ETag
+        options += f"-z {filepath} "
+        if Path(etag).exists():
+            options += f"--etag-compare {etag} "
+    return options
 
 
 def excel_to_gbq(io=None, destination=None, credentials=None, GCP=None):
     """Load Excel to BigQuery.
 
+    The first sheet is read with `python-calamine` and converted to Arrow in chunks of rows,
+    which are combined, written to Parquet and uploaded in a single load job, replacing the
+    destination table.
+
     Args:
-        - io: str, bytes, ExcelFile, xlrd.Book, path object, or file-like object passed to `pandas.read_excel`
-        - destination_table (str): name of destination table in BigQuery in format `dataset.tablename`      
+        - io: str, path object, or file-like object with the Excel workbook
+        - destination (str): name of destination table in BigQuery in format `dataset.tablename`
         - credentials (google.auth.credentials.Credentials): credentials for project and BigQuery
         - GCP (dataclass): configuration object with `project` and `location` attributes
     
     Returns:
         - google.cloud.bigquery.job.LoadJob
     """
-    df = pd.read_excel(io).rename(columns=clean_python_name)
+    rows = CalamineWorkbook.from_object(io).get_sheet_by_index(0).iter_rows()
+    columns = [
+        # Blank header cells clean to "" --> name them by position
+        c or f"unnamed__{i}"
+        for i, c in enumerate(clean_python_names(map(str, next(rows))))
+    ]
+    duplicates = sorted({c for c in columns if columns.count(c) > 1})
+    if duplicates:
+        # Rows are converted via dicts, which would silently drop all but one of these
+        raise ValueError(f"Column names are not unique after cleaning: {duplicates}")
+
     bq = bigquery.Client(credentials=credentials, project=GCP.project)
-    job_config = bigquery.LoadJobConfig()
-    job_config.write_disposition= "WRITE_TRUNCATE"
-    job = bq.load_table_from_dataframe(
-        dataframe=df,
-        destination=destination_table,
-        job_config=job_config,
-        credentials=credentials,
-        project=GCP.project,
-        location=GCP.location,
-    )
+    job_config = bigquery.LoadJobConfig(source_format=bigquery.SourceFormat.PARQUET)
+    job_config.write_disposition = "WRITE_TRUNCATE"
+
+    # Convert rows in chunks, so only one chunk at a time is held as Python objects
+    chunks = [
+        # calamine returns empty cells as empty strings --> null
+        pa.Table.from_pylist(
+            [{c: (None if v == "" else v) for c, v in zip(columns, row)} for row in chunk]
+        )
+        for chunk in iter(lambda: list(islice(rows, _EXCEL_CHUNK_ROWS)), [])
+    ]
+    if chunks:
+        # Types are inferred per chunk --> combine before fixing the schema
+        table = _narrow_integral(_combine_tables(chunks))
+    else:
+        # Header only --> empty table with string columns
+        table = pa.schema([(c, pa.string()) for c in columns]).empty_table()
+
+    with TemporaryFile() as pq_file:
+        pq.write_table(table, pq_file)
+        pq_file.seek(0)
+        job = bq.load_table_from_file(
+            pq_file,
+            destination=destination,
+            job_config=job_config,
+            project=GCP.project,
+            location=GCP.location,
+        )
     return job
 
 
+def _narrow_integral(table):
+    """Casts float columns that only contain whole numbers to int64.
+
+    calamine returns all numeric cells as float, so integer columns in Excel would
+    otherwise become FLOAT in BigQuery.
+    """
+    fields = []
+    for field, column in zip(table.schema, table.columns):
+        if pa.types.is_floating(field.type) and column.null_count < len(column):
+            min_max = pc.min_max(column)
+            if (
+                pc.all(pc.equal(pc.floor(column), column)).as_py()
+                and -(2 ** 63) <= min_max["min"].as_py()
+                and min_max["max"].as_py() < 2 ** 63
+            ):
+                field = field.with_type(pa.int64())
+        fields.append(field)
+    return table.cast(pa.schema(fields))
+
+
+def zip_member_to_gbq(zipfile, member, destination=None, credentials=None, GCP=None):
+    """Load CSV member of zipfile to BigQuery, without extracting it to disk.
+
+    The member is decompressed while it is being uploaded in a single load job, which
+    replaces the destination table. The schema is detected by BigQuery.
+
+    Args:
+        - zipfile: path to zipfile
+        - member (str): name of CSV file in zipfile, with a header row
+        - destination (str): name of destination table in BigQuery in format `dataset.tablename`
+        - credentials (google.auth.credentials.Credentials): credentials for project and BigQuery
+        - GCP (dataclass): configuration object with `project` and `location` attributes
+
+    Returns:
+        - google.cloud.bigquery.job.LoadJob
+    """
+    bq = bigquery.Client(credentials=credentials, project=GCP.project)
+    job_config = bigquery.LoadJobConfig(source_format=bigquery.SourceFormat.CSV)
+    job_config.skip_leading_rows = 1
+    job_config.autodetect = True
+    job_config.write_disposition = "WRITE_TRUNCATE"
+
+    with ZipFile(zipfile) as zip:
+        info = zip.getinfo(member)
+        with zip.open(info) as src, _ZipMemberReader(src) as reader:
+            job = bq.load_table_from_file(
+                reader,
+                destination=destination,
+                size=info.file_size,
+                job_config=job_config,
+                project=GCP.project,
+                location=GCP.location,
+            )
+    return job
+
+
+class _ZipMemberReader(io.RawIOBase):
+    """Forward-only binary reader of a zip member, as accepted by `load_table_from_file`.
+
+    `ZipExtFile` reports mode "r", which the BigQuery client rejects as a text mode file,
+    and the upload only needs `read` and `tell`. A background thread decompresses ahead
+    into a bounded queue, so inflating overlaps with waiting on the network.
+    """
+
+    def __init__(self, src, prefetch=4):
+        self._chunks = Queue(maxsize=prefetch)
+        self._chunk = memoryview(b"")
+        self._eof = False
+        self._error = None
+        self._position = 0
+        self._closing = Event()
+        self._thread = Thread(target=self._prefetch, args=(src,), daemon=True)
+        self._thread.start()
+
+    def _prefetch(self, src):
+        try:
+            while not self._closing.is_set():
+                chunk = src.read(_COPY_BUFSIZE)
+                self._put(chunk)
+                if not chunk:
+                    return
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item):
+        # Don't block forever, when the reader is closed before the end of the member
+        while not self._closing.is_set():
+            try:
+                self._chunks.put(item, timeout=0.1)
+                return
+            except Full:
+                pass
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        # Fill b completely: the resumable upload takes a short read for the end of the file
+        if self._error is not None:
+            # The prefetch thread has stopped --> don't wait for chunks that never come
+            raise self._error
+        n = 0
+        while n < len(b) and not self._eof:
+            if not self._chunk:
+                chunk = self._chunks.get()
+                if isinstance(chunk, Exception):
+                    self._error = chunk
+                    raise chunk
+                if not chunk:
+                    self._eof = True
+                    break
+                self._chunk = memoryview(chunk)
+            size = min(len(b) - n, len(self._chunk))
+            b[n : n + size] = self._chunk[:size]
+            self._chunk = self._chunk[size:]
+            n += size
+        self._position += n
+        return n
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        self._closing.set()
+        self._thread.join()
+        super().close()
+
+
 def unzip(zipfile):
     """Extracts zipfile from path in the same directory.
 
     Replaces original zipfile with empty file, so downstream tasks know the file is there.
+    Members are decompressed in parallel from one file descriptor, since zlib releases the GIL.
 
     Args:
         - path: Path-object to zipfile
         - zipfile
 
     Returns:
-        Path-objects of extracted files
+        Path-objects of extracted files, without directories
     """
-    with ZipFile(zipfile) as zip:
-        zip.extractall(path=zipfile.parent)
-        files = [zipfile.parent / f for f in zip.namelist()]
+    members = _zip_members(zipfile)
+
+    # Create directory tree once up front, instead of per extracted file in the workers
+    targets = [(info, _member_path(zipfile.parent, info.filename)) for info in members]
+    for directory in sorted(
+        {path if info.is_dir() else path.parent for info, path in targets}
+    ):
+        directory.mkdir(parents=True, exist_ok=True)
+    targets = [(info, path) for info, path in targets if not info.is_dir()]
+
+    workers = min(len(targets), os.cpu_count() or 1) or 1
+    with open(zipfile, "rb") as f, ThreadPoolExecutor(max_workers=workers) as executor:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        # os.pread doesn't move the file offset --> all workers share one file descriptor
+        list(
+            executor.map(
+                lambda target: _extract_member(f.fileno(), zipfile, *target), targets
+            )
+        )
+    # Truncate in place, so the file never disappears for tasks checking whether it exists
+    with open(zipfile, "wb"):
+        pass
+    return [path for _, path in targets]
+
+
+def _zip_members(zipfile):
+    """ZipInfo of all members of zipfile, parsing its central directory from a memory map.
+
+    The many small seeks and reads for the central directory become page cache lookups.
+    """
+    with open(zipfile, "rb") as f:
+        if not os.fstat(f.fileno()).st_size:
+            # mmap refuses empty files
+            raise BadZipFile(f"File is empty: {zipfile}")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, ZipFile(mm) as zip:
+            return zip.infolist()
 
-    zipfile.unlink()
-    zipfile.touch()
-    return files
+
+def _extract_member(fd, zipfile, info, path):
+    """Extracts member `info` of zipfile to path, which directory must exist already.
+
+    Stored and deflated members are read with `os.pread` from the shared file descriptor
+    fd, in chunks with a large buffer to reduce the number of read/write syscalls.
+    Other members, e.g. encrypted or bzip2/lzma compressed, are extracted with `ZipFile`.
+    """
+    if (
+        not hasattr(os, "pread")
+        or info.compress_type not in (ZIP_STORED, ZIP_DEFLATED)
+        or info.flag_bits & 0x1
+    ):
+        with ZipFile(zipfile) as zip, zip.open(info) as src, open(path, "wb") as dst:
+            shutil.copyfileobj(src, dst, length=_COPY_BUFSIZE)
+        return
+
+    # Data follows the local file header, whose name and extra field lengths may differ
+    # from the central directory
+    header = os.pread(fd, 30, info.header_offset)
+    name_length, extra_length = struct.unpack("<HH", header[26:30])
+    offset = info.header_offset + 30 + name_length + extra_length
+
+    if info.compress_type == ZIP_STORED and _copy_stored(fd, info, offset, path):
+        return
+
+    if info.compress_type == ZIP_DEFLATED and info.file_size <= _INFLATE_ONESHOT_SIZE:
+        # libdeflate inflates whole buffers at once, about twice as fast as streaming zlib
+        compressed = os.pread(fd, info.compress_size, offset)
+        try:
+            data = deflate.deflate_decompress(compressed, info.file_size)
+        except deflate.DeflateError as e:
+            raise BadZipFile(f"Bad compressed data for file {info.filename}") from e
+        if deflate.crc32(data) != info.CRC:
+            raise BadZipFile(f"Bad CRC-32 for file {info.filename}")
+        with open(path, "wb") as dst:
+            dst.write(data)
+        return
+
+    inflate = zlib.decompressobj(-zlib.MAX_WBITS) if info.compress_type == ZIP_DEFLATED else None
+    end = offset + info.compress_size
+    crc = 0
+    with open(path, "wb") as dst:
+        while offset < end:
+            chunk = os.pread(fd, min(_COPY_BUFSIZE, end - offset), offset)
+            if not chunk:
+                raise BadZipFile(f"Truncated zip member {info.filename}")
+            offset += len(chunk)
+            if inflate is None:
+                crc = zlib.crc32(chunk, crc)
+                dst.write(chunk)
+                continue
+            # Bound output per call, deflate can expand data over a 1000 times
+            while chunk:
+                data = inflate.decompress(chunk, _COPY_BUFSIZE)
+                crc = zlib.crc32(data, crc)
+                dst.write(data)
+                chunk = inflate.unconsumed_tail
+        if inflate is not None:
+            data = inflate.flush()
+            crc = zlib.crc32(data, crc)
+            dst.write(data)
+
+    if crc != info.CRC:
+        raise BadZipFile(f"Bad CRC-32 for file {info.filename}")
+
+
+def _copy_stored(fd, info, offset, path):
+    """Copies uncompressed zip member, with data at offset, in kernel space with `os.copy_file_range`.
+
+    Returns False if the copy isn't supported, so the caller can fall back to reading and
+    writing. The CRC is verified on a second pass over the source, which the copy left in
+    the page cache.
+    """
+    if not hasattr(os, "copy_file_range"):
+        return False
+
+    with open(path, "wb") as dst:
+        position = offset
+        remaining = info.file_size
+        try:
+            while remaining:
+                copied = os.copy_file_range(
+                    fd, dst.fileno(), remaining, offset_src=position
+                )
+                if not copied:
+                    raise BadZipFile(f"Truncated zip member {info.filename}")
+                position += copied
+                remaining -= copied
+        except OSError:
+            # E.g. ENOSYS or EXDEV on older kernels --> use the regular path
+            dst.truncate(0)
+            return False
+
+    crc = 0
+    while offset < position:
+        chunk = os.pread(fd, min(_COPY_BUFSIZE, position - offset), offset)
+        offset += len(chunk)
+        crc = zlib.crc32(chunk, crc)
+    if crc != info.CRC:
+        raise BadZipFile(f"Bad CRC-32 for file {info.filename}")
+    return True
+
+
+def _member_path(directory, name):
+    """Path in directory for zip member name, dropping absolute and `..` parts like `ZipFile.extract`."""
+    parts = [p for p in name.replace("\\", "/").split("/") if p not in ("", ".", "..")]
+    return directory.joinpath(*parts)
 
 
 def create_dir(path: Path) -> Path:
-    """Checks whether path exists and is directory, and creates it if not.
+    """Creates directory path, including parents, if it doesn't exist yet.
     
     Args:
         - path (Path): path to check
     
     Returns:
         - Path: new directory
+
+    Raises:
+        - TypeError: if path is not a str or path object
+        - FileExistsError: if path exists but is not a directory
     """
-    try:
-        path = Path(path)
-        if not (path.exists() and path.is_dir()):
-            path.mkdir(parents=True)
-        return path
-    except TypeError as error:
-        print(f"Error trying to find {path}: {error!s}")
-        return None
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
 
 
-def get_description(url_data_definition):
-    """Getting the descriptions of columns from a data set given in url_data_definition.
+def get_json(url):
+    """Fetches url with the shared session and parses the response with `orjson`.
+
+    `orjson` is several times faster than the standard library `json` used by
+    `requests.Response.json` on large OData pages.
+
+    Args:
+        - url (str): url returning JSON
+
+    Returns:
+        - dict or list: parsed JSON
+
+    Raises:
+        - requests.HTTPError: if the response has a 4xx or 5xx status
+    """
+    response = _SESSION.get(url, timeout=30)
+    response.raise_for_status()
+    return orjson.loads(response.content)
+
+
+def _truncate_description(description):
+    """Shortens description to 1024 characters, since BigQuery doesn't allow longer ones."""
+    if description is not None and len(description) > 1024:
+        return description[:1021] + "..."
+    return description
+
+
+@lru_cache(maxsize=128)
+def fetch_data_properties(url_data_definition):
+    """Fetches the rows of a DataProperties data set, at most once per url.
 
     Args:
         - url_data_definition (str): url of DataProperties data set as String.
 
     Return:
-        - dict{'column_name':'description'}
+        - list[dict]: rows of the data set
     """
-    # Get JSON format of data set.
-    url_data_info = "?".join((url_data_definition, "$format=json"))
-    # print("Data Property:", url_data_info)
-
-    data_info = requests.get(url_data_info).json() # Is of type dict()
+    return get_json("?".join((url_data_definition, "$format=json")))["value"]
 
-    data_info_values = data_info["value"] # Is of type list
 
-    dict_description = {}
+def get_description(url_data_definition):
+    """Getting the descriptions of columns from a data set given in url_data_definition.
 
-    # Only dict's containing the key 'Key' has information about table columns.
-    for i in data_info_values:
-        if i["Key"] != "":
-            # Make description shorter, since BigQuery only allows 1024 characters
-            if i["Description"] is not None and len(i["Description"]) > 1024:
-                i["Description"] = i["Description"][:1021] + "..."
+    Args:
+        - url_data_definition (str): url of DataProperties data set as String.
 
-            dict_description[i["Key"]] = i["Description"]
+    Return:
+        - dict{'column_name':'description'}
+    """
+    data_info_values = fetch_data_properties(url_data_definition) # Is of type list
 
+    # Only dict's containing the key 'Key' has information about table columns.
+    # Rows are shared with the fetch_data_properties cache --> don't modify them
+    dict_description = {
+        i["Key"]: _truncate_description(i["Description"])
+        for i in data_info_values
+        if i["Key"]
+    }
 
     return dict_description
 
@@ -190,9 +667,8 @@ def column_descriptions(table_id, third_party=False, schema_bq="cbs", GCP=None):
         False: f"https://opendata.cbs.nl/ODataFeed/odata/{table_id}?$format=json",
     }
 
-    for i in requests.get(base_url[third_party]).json()["value"]:
-        if "DataProperties" in i.values():
-            url_data_properties = i["url"]
+    urls = {item["name"]: item["url"] for item in get_json(base_url[third_party])["value"]}
+    url_data_properties = urls["DataProperties"]
 
     table_typed = bq.get_table(f"{GCP.project}.{schema_bq}.{table_id}_TypedDataSet")
 
@@ -201,20 +677,13 @@ def column_descriptions(table_id, third_party=False, schema_bq="cbs", GCP=None):
 
     # for i in table_schema:
     for i in table_typed.schema:
-        # print("Name:", i.to_api_repr()['name'])
-        # print("Field_type:", i.to_api_repr()['type'])
-        # print("Description:", i.to_api_repr()['description'])
-
-        if i.to_api_repr()['name'] not in descriptions:
-            new_description = ""
-        else:
-            new_description = descriptions[i.to_api_repr()['name']]
-
+        # Plain attributes of SchemaField, no need to serialize with to_api_repr()
         new_schema.append(
             bigquery.SchemaField(
-                name=i.to_api_repr()['name'],
-                field_type=i.to_api_repr()['type'],
-                description=new_description
+                name=i.name,
+                field_type=i.field_type,
+                mode=i.mode,
+                description=descriptions.get(i.name, ""),
             )
         )
 
@@ -222,9 +691,12 @@ def column_descriptions(table_id, third_party=False, schema_bq="cbs", GCP=None):
     bq.update_table(table_typed, ["schema"])
 
 
+@lru_cache(maxsize=1024)
 def table_description(url_table_infos):
     """Load table description to corresponding table in BigQuery.
 
+    Descriptions are cached per url, so reruns and repeated loads don't fetch them again.
+
     Args:
         - url_table_infos (str): url of the data set `TableInfos`
     
@@ -234,7 +706,7 @@ def table_description(url_table_infos):
 
     # Using TableInfos for the description of the tables.
     url_table_info = "?".join((url_table_infos, "$format=json"))
-    table_info = requests.get(url_table_info).json()
+    table_info = get_json(url_table_info)
 
     # Get the complete description from TableInfos.
     table_description = table_info["value"][0]["Description"]
@@ -242,7 +714,153 @@ def table_description(url_table_infos):
     return table_description
 
 
-@task
+def odata_pages(url, page_size=10_000, max_workers=8):
+    """Fetches all pages of an OData v3 resource concurrently.
+
+    The total row count is requested first with `$inlinecount`, so pages can be fetched in
+    parallel with `$skip`/`$top` instead of sequentially following `odata.nextLink`. A page
+    that is cut short by the server limit is completed by following its `odata.nextLink`.
+    Resources that don't report a count are paged sequentially.
+
+    Args:
+        - url (str): url of the OData resource, including `?$format=json`
+        - page_size (int): number of rows per request, CBS allows at most 10,000
+        - max_workers (int): number of concurrent requests
+
+    Yields:
+        - pyarrow.Table: rows of each page, in order
+    """
+
+    def fetch(page_url):
+        tables = []
+        while page_url:
+            table, page_url = _fetch_odata_page(page_url)
+            tables.append(table)
+        # Type inference per request may differ, e.g. null for a column that is empty in one
+        # request, or int64 where another has decimals --> promote to common types
+        return pa.concat_tables(tables, promote_options="permissive")
+
+    r = get_json(f"{url}&$inlinecount=allpages&$top=0")
+    if "odata.count" not in r:
+        yield fetch(url)
+        return
+
+    page_urls = [
+        f"{url}&$skip={skip}&$top={page_size}"
+        for skip in range(0, int(r["odata.count"]), page_size)
+    ]
+
+    # Keep a bounded number of pages in flight, so memory doesn't grow with table size
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for page_url in page_urls:
+            pending.append(executor.submit(fetch, page_url))
+            if len(pending) > max_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _fetch_odata_page(url):
+    """Fetches one OData page, which is bounded by `$top` or the server limit.
+
+    Args:
+        - url (str): url of an OData page
+
+    Returns:
+        - pyarrow.Table: rows of the page
+        - str: `odata.nextLink` of the page, or None
+    """
+    r = get_json(url)
+    return pa.Table.from_pylist(r["value"]), r.get("odata.nextLink")
+
+
+def _odata_row_groups(url, key, logger, types=None):
+    """Fetches all pages of OData resource url as row groups with one schema.
+
+    Pages are collected until they hold `_ROW_GROUP_ROWS` rows or `_ROW_GROUP_BYTES`, so
+    only one row group is kept in memory. The schema is fixed at the first row group:
+    columns in types get that type, the others get the type promoted across the pages of
+    the first row group. Columns without any value become string.
+
+    Args:
+        - url (str): url of OData resource
+        - key (str): name of resource, for logging
+        - logger: logger to report progress to
+        - types (dict): Arrow type per column, e.g. from `_typed_data_set_types`
+
+    Yields:
+        - pyarrow.Table: rows of each row group, in order
+    """
+    schema = None
+    pages, rows, nbytes = [], 0, 0
+    # Pages are fetched concurrently ahead of processing them here
+    for i, page in enumerate(odata_pages(url)):
+        logger.info(f"Processing {key} (i = {i}) from {url}")
+        # odata api contains empty lists as values --> skip these
+        if not page.num_rows:
+            continue
+        # DataProperties contains column odata.type --> odata_type
+        pages.append(page.rename_columns([c.replace(".", "_") for c in page.column_names]))
+        rows += page.num_rows
+        nbytes += page.nbytes
+        if rows >= _ROW_GROUP_ROWS or nbytes >= _ROW_GROUP_BYTES:
+            schema = schema or _row_group_schema(pages, types or {})
+            yield _conform_pages(pages, schema)
+            pages, rows, nbytes = [], 0, 0
+    if pages:
+        schema = schema or _row_group_schema(pages, types or {})
+        yield _conform_pages(pages, schema)
+
+
+def _row_group_schema(pages, types):
+    """Schema for pages, with types inferred per page, and types per column taking precedence."""
+    schema = pa.unify_schemas([page.schema for page in pages], promote_options="permissive")
+    return pa.schema(
+        [
+            f.with_type(types.get(f.name, pa.string() if pa.types.is_null(f.type) else f.type))
+            for f in schema
+        ]
+    )
+
+
+def _conform_pages(pages, schema):
+    """Combines pages into one table with schema, raising if a value doesn't fit its type."""
+    return pa.concat_tables(pages, promote_options="permissive").cast(schema)
+
+
+def _typed_data_set_types(url_data_properties):
+    """Arrow types of the topics of a TypedDataSet, from their Datatype in DataProperties.
+
+    Args:
+        - url_data_properties (str): url of the DataProperties data set
+
+    Returns:
+        - dict{'column_name': pyarrow.DataType}
+    """
+    return {
+        i["Key"]: _CBS_DATATYPES[i["Datatype"]]
+        for i in fetch_data_properties(url_data_properties)
+        if i.get("Datatype") in _CBS_DATATYPES
+    }
+
+
+def _combine_tables(tables):
+    """Combines tables, with types inferred per chunk of rows, into one table.
+
+    Types are promoted across chunks, e.g. from null to string for a column that is empty
+    in the first chunk, or from int64 to double. Columns without any value become string.
+    """
+    table = pa.concat_tables(tables, promote_options="permissive")
+    return table.cast(
+        pa.schema(
+            [f.with_type(pa.string()) if pa.types.is_null(f.type) else f for f in table.schema]
+        )
+    )
+
+
+# Reruns with the same inputs within a day reuse the finished load jobs, instead of fetching and loading again
+@task(cache_for=datetime.timedelta(days=1), cache_validator=all_inputs)
 def cbsodatav3_to_gbq(id, third_party=False, schema="cbs", credentials=None, GCP=None):
     """Load CBS odata v3 into Google BigQuery.
 
@@ -263,7 +881,7 @@ def cbsodatav3_to_gbq(id, third_party=False, schema="cbs", credentials=None, GCP
         - GCP: config object
 
     Return:
-        - List[google.cloud.bigquery.job.LoadJob] 
+        - List[google.cloud.bigquery.job.LoadJob]: finished load jobs
 
     [^odatav3]: https://www.cbs.nl/-/media/statline/documenten/handleiding-cbs-opendata-services.pdf
     """
@@ -274,16 +892,20 @@ def cbsodatav3_to_gbq(id, third_party=False, schema="cbs", credentials=None, GCP
     }
     urls = {
         item["name"]: item["url"]
-    for item in requests.get(base_url[third_party]).json()["value"]
+    for item in get_json(base_url[third_party])["value"]
     }
 
     bq = bigquery.Client(project=GCP.project)
-    job_config = bigquery.LoadJobConfig()
+    job_config = bigquery.LoadJobConfig(source_format=bigquery.SourceFormat.PARQUET)
 
-    # Need to append because API may return more than 1 rowset (max 10.000 rows per call)
-    job_config.write_disposition = "WRITE_APPEND"
+    # All pages of a table are collected in one Parquet file --> one load job per table
+    job_config.write_disposition = "WRITE_TRUNCATE"
     job_config.destination_table_description=table_description(urls["TableInfos"])
     jobs = []
+    logger = prefect.context.get("logger")
+
+    # Types of topics are known up front, since pages may infer them differently
+    types = {"TypedDataSet": _typed_data_set_types(urls["DataProperties"])}
 
     # TableInfos is redundant --> use https://opendata.cbs.nl/ODataCatalog/Tables?$format=json
     # UntypedDataSet is redundant --> use TypedDataSet
@@ -292,42 +914,42 @@ def cbsodatav3_to_gbq(id, third_party=False, schema="cbs", credentials=None, GCP
     ]:
         url = "?".join((url, "$format=json"))
         table_name = f"{schema}.{id}_{key}"
-        bq.delete_table(table=table_name, not_found_ok=True)
-
-        i = 0
-        while url:
-            logger = prefect.context.get("logger")
-            logger.info(f"Processing {key} (i = {i}) from {url}")
-            r = requests.get(url).json()
-
-            # odata api contains empty lists as values --> skip these
-            if r["value"]:
-                # DataProperties contains column odata.type --> odata_type
-                df = pd.DataFrame(r["value"]).rename(
-                    columns=lambda s: s.replace(".", "_")
-                )
 
-                jobs.append(
-                    bq.load_table_from_dataframe(
-                        df,
-                        destination=table_name,
-                        project=GCP.project,
-                        job_config=job_config,
-                    )
+        with TemporaryFile() as pq_file:
+            pq_writer = None
+            # Row groups are written as they come in, so memory doesn't grow with table size
+            for row_group in _odata_row_groups(url, key, logger, types.get(key)):
+                if pq_writer is None:
+                    pq_writer = pq.ParquetWriter(pq_file, schema=row_group.schema)
+                pq_writer.write_table(row_group)
+
+            if pq_writer is None:
+                # No data at all --> don't leave a stale table behind
+                bq.delete_table(table=table_name, not_found_ok=True)
+                continue
+
+            pq_writer.close()
+            pq_file.seek(0)
+            jobs.append(
+                bq.load_table_from_file(
+                    pq_file,
+                    destination=table_name,
+                    project=GCP.project,
+                    job_config=job_config,
                 )
+            )
 
-            # each request limited to 10,000 cells
-            if "odata.nextLink" in r:
-                i += 1
-                url = r["odata.nextLink"]
-            else:
-                url = None
+    # Only cache the result once every load has succeeded, raises if one failed
+    for job in jobs:
+        job.result()
 
     return jobs
 
 
 @task(name="get_cbs_data", result=PrefectResult())
-def cbsodatav3_to_gcs(id, third_party=False, schema="cbs", credentials=None, GCP=None, paths=None):
+def cbsodatav3_to_gcs(
+    id, third_party=False, schema="cbs", credentials=None, GCP=None, paths=None, max_uploads=2
+):
     """Load CBS odata v3 into Google Cloud Storage as Parquet.
 
     For given dataset id, following tables are uploaded into schema (taking `cbs` as default and `83583NED` as example):
@@ -344,7 +966,8 @@ def cbsodatav3_to_gcs(id, third_party=False, schema="cbs", credentials=None, GCP
         - schema (str): schema to load data into
         - credentials: GCP credentials
         - GCP: config object
-        - Paths: config object for output directory
+        - paths: unused, files are written to GCS directly
+        - max_uploads (int): number of tables fetched and uploaded concurrently
 
     Return:
         - Set: Paths to Parquet files
@@ -357,77 +980,112 @@ def cbsodatav3_to_gcs(id, third_party=False, schema="cbs", credentials=None, GCP
     }
     urls = {
         item["name"]: item["url"]
-        for item in requests.get(base_url[third_party]).json()["value"]
-    }
-
-    output = {
-        True: paths.root / paths.tmp,
-        False: paths.root / paths.cbs,
+        for item in get_json(base_url[third_party])["value"]
     }
 
     # Getting the description of the data set.
     data_set_description = table_description(urls["TableInfos"])
 
-    gcs = storage.Client(project="dataverbinders")
-    gcs_bucket = gcs.bucket(GCP.bucket)
+    # Parquet is streamed straight into GCS, without staging files on local disk
+    gcs = _gcs_filesystem(credentials, GCP.project)
 
     files_parquet = set()
+    logger = prefect.context.get("logger")
 
-    # TableInfos is redundant --> use https://opendata.cbs.nl/ODataCatalog/Tables?$format=json
-    # UntypedDataSet is redundant --> use TypedDataSet
-    for key, url in [
-        (k, v) for k, v in urls.items() if k not in ("TableInfos", "UntypedDataSet")
-    ]:
-        url = "?".join((url, "$format=json"))
-        table_name = f"{schema}.{id}_{key}"
+    # Types of topics are known up front, since pages may infer them differently
+    types = {"TypedDataSet": _typed_data_set_types(urls["DataProperties"])}
+
+    def finish(table_name, upload):
+        # Surface upload errors before the files are handed to BigQuery
+        if upload.result():
+            # Add path of file to set, when data set contains information
+            files_parquet.add(f"{table_name}.parquet")
+
+    # Each upload fetches its own pages concurrently and holds a row group in memory
+    # --> keep a bounded number of uploads in flight
+    with ThreadPoolExecutor(max_workers=max_uploads) as upload_ex:
+        uploads = deque()
+        # TableInfos is redundant --> use https://opendata.cbs.nl/ODataCatalog/Tables?$format=json
+        # UntypedDataSet is redundant --> use TypedDataSet
+        for key, url in [
+            (k, v) for k, v in urls.items() if k not in ("TableInfos", "UntypedDataSet")
+        ]:
+            url = "?".join((url, "$format=json"))
+            table_name = f"{schema}.{id}_{key}"
+
+            # Fetch, write and upload while the next table is being fetched
+            row_groups = _odata_row_groups(url, key, logger, types.get(key))
+            uploads.append(
+                (
+                    table_name,
+                    upload_ex.submit(
+                        _upload_parquet, gcs, f"{GCP.bucket}/{table_name}.parquet", row_groups
+                    ),
+                )
+            )
+            if len(uploads) >= max_uploads:
+                finish(*uploads.popleft())
+        while uploads:
+            finish(*uploads.popleft())
 
-        i = 0
+    return files_parquet, data_set_description
 
-        while url:
-            logger = prefect.context.get("logger")
-            logger.info(f"Processing {key} (i = {i}) from {url}")
-            r = requests.get(url).json()
 
-            # odata api contains empty lists as values --> skip these
-            if r["value"]:
-                # DataProperties contains column odata.type --> odata_type
-                df = pd.DataFrame(r["value"]).rename(
-                    columns=lambda s: s.replace(".", "_")
-                )
-                
-                pq_dir = f"{output[third_party]}/{table_name}.parquet"
-
-                # Add path of file to set, when data set contains information
-                files_parquet.add(f"{table_name}.parquet")
-
-                cbs_table = pa.Table.from_pandas(df)
-
-                if i == 0:
-                    # Have to append the lines, instead of overwrite.
-                    # https://stackoverflow.com/questions/47113813/using-pyarrow-how-do-you-append-to-parquet-file/47114713
-                    # Use gzip as compression, is one of the accepted compression types. With default level = 6.
-                    pq_writer = pq.ParquetWriter(where=pq_dir, schema=cbs_table.schema, compression="gzip", compression_level=6)
-                    
-                # Write transformed df to the given file (pq_dir)
-                pq_writer.write_table(cbs_table)
-            
-            # each request limited to 10,000 cells
-            if "odata.nextLink" in r:
-                i += 1
-                url = r["odata.nextLink"]
-            else:
-                # Add upload to GCS here!!!
-                pq_writer.close() # Close the Parquet Writer
-
-                # Name of file in GCS.
-                gcs_blob = gcs_bucket.blob(pq_dir.split("/")[-1])
-
-                # Upload file to GCS from given location.
-                gcs_blob.upload_from_filename(filename=pq_dir)
-                
-                url = None
+def _gcs_filesystem(credentials, project):
+    """Arrow file system for GCS, authenticated with credentials.
 
-    return files_parquet, data_set_description
+    Args:
+        - credentials (google.auth.credentials.Credentials): GCP credentials, or None for
+          the default credentials of the environment
+        - project (str): GCP project
+
+    Returns:
+        - pyarrow.fs.GcsFileSystem
+    """
+    if credentials is None:
+        return pa.fs.GcsFileSystem(project_id=project)
+
+    # Arrow takes an access token instead of google-auth credentials
+    if not credentials.valid:
+        credentials.refresh(Request())
+    return pa.fs.GcsFileSystem(
+        access_token=credentials.token,
+        credential_token_expiration=credentials.expiry,
+        project_id=project,
+    )
+
+
+def _upload_parquet(gcs, path, row_groups):
+    """Writes row groups as Parquet to path on GCS, streaming them without a local file.
+
+    Args:
+        - gcs (pyarrow.fs.GcsFileSystem): file system to write to
+        - path (str): path of the Parquet file, including the bucket
+        - row_groups (iterable of pyarrow.Table): row groups with one schema
+
+    Returns:
+        - bool: whether the file was written, no file is written without rows
+    """
+    row_groups = iter(row_groups)
+    first = next(row_groups, None)
+    if first is None:
+        return False
+
+    with gcs.open_output_stream(path) as stream:
+        # Use zstd level 3: several times faster than gzip at a similar ratio, and read natively by BigQuery.
+        with pq.ParquetWriter(
+            stream,
+            schema=first.schema,
+            compression="zstd",
+            compression_level=3,
+            use_dictionary=True,
+            data_page_size=1 << 20,
+            write_statistics=False,
+        ) as pq_writer:
+            pq_writer.write_table(first)
+            for row_group in row_groups:
+                pq_writer.write_table(row_group)
+    return True
 
 
 def create_dataset(name, bq_client):
@@ -456,26 +1114,19 @@ def gcs_to_bq(prefect_output, third_party=False, credentials=None, GCP=None):
         - GCP: config object
     """
 
-    awaiting_jobs = set()
-
-    def callback(future):
-        awaiting_jobs.discard(future.job_id)
-
     logger = prefect.context.get("logger")
     parquet_list = prefect_output[0]
 
     bq = bigquery.Client(project=GCP.project, location=GCP.location)
 
     # Create new Data Set if not already present.
-    data_set_id = re.split(r'[._]', list(prefect_output[0])[0])[0]
+    data_set_id = _DATASET_ID_RE.split(next(iter(parquet_list)), maxsplit=1)[0]
     create_dataset(name=data_set_id, bq_client=bq)
 
     job_config = bigquery.LoadJobConfig(source_format=bigquery.SourceFormat.PARQUET)
     job_config.destination_table_description=prefect_output[1]
-    jobs = []
-
-    for parquet_file in parquet_list:
 
+    def load(parquet_file):
         gcs_url = f"gs://{GCP.bucket}/{parquet_file}"
         table_name = parquet_file[:-8]
         bq.delete_table(table=table_name, not_found_ok=True)
@@ -486,17 +1137,14 @@ def gcs_to_bq(prefect_output, third_party=False, credentials=None, GCP=None):
             project=GCP.project,
             job_config=job_config,
         )
+        # Blocks until the job is done, raises if it failed
+        load_job.result()
+        return table_name
 
-        jobs.append(load_job)
-
-        awaiting_jobs.add(load_job.job_id)
-        load_job.add_done_callback(callback)
-    
-
-    while awaiting_jobs:
-        logger.info(f"{len(awaiting_jobs)} remaining data set(s) loading into BQ.... ")
-        sleep(1)
-    
+    # Submit all load jobs concurrently and log each one as it completes
+    with ThreadPoolExecutor(max_workers=min(8, len(parquet_list)) or 1) as executor:
+        futures = [executor.submit(load, parquet_file) for parquet_file in parquet_list]
+        for n, future in enumerate(as_completed(futures), start=1):
+            logger.info(f"Loaded {future.result()} into BQ ({n}/{len(futures)})")
 
     logger.info("The data sets have been loaded into BQ")
-    
@@ -1,3 +1,19 @@
+import re
+from string import ascii_letters, digits
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Leading characters until a letter or underscore
+_LEADING = re.compile(r"^[^a-zA-Z_]+")
+# Maps every Latin-1 character that is not a valid ASCII identifier character to underscore
+_TRANS = str.maketrans(
+    {c: "_" for c in map(chr, range(256)) if c not in ascii_letters + digits + "_"}
+)
+_INVALID = re.compile(r"[^0-9a-zA-Z_]")
+
+
 def clean_python_name(s):
     """Method to convert string to Python 2 object name.
     
@@ -15,6 +31,9 @@ def clean_python_name(s):
     .. code:: python
     
         df.rename(columns=clean_python_name)
+
+        # or for all columns at once, see `clean_python_names`
+        table.rename_columns(clean_python_names(table.column_names))
     
     Args:
         - s (str): string to be converted
@@ -22,13 +41,57 @@ def clean_python_name(s):
     Returns:
         str: cleaned string
     """
-    
-    import re
 
     # Remove leading characters until we find a letter or underscore, and remove trailing spaces
-    s = re.sub('^[^a-zA-Z_]+', '', s.strip())
+    s = _LEADING.sub("", s.strip())
+
+    # Replace invalid characters with underscores, in one pass over the string
+    s = s.translate(_TRANS)
+    if not s.isascii():
+        # Characters beyond Latin-1 are not in the translation table
+        s = _INVALID.sub("_", s)
+
+    return s.lower()
+
+
+def clean_python_names(names):
+    """Converts many strings to Python object names, see `clean_python_name`.
+
+    Example:
+
+    .. code:: python
+
+        df.columns = clean_python_names(df.columns)
+
+    Args:
+        - names (iterable): strings to be converted
+
+    Returns:
+        list: cleaned strings, in the same order
+    """
+    return [clean_python_name(s) for s in names]
 
-    # Replace invalid characters with underscores
-    s = re.sub('[^0-9a-zA-Z_]', '_', s)
 
-    return s.lower()
\ No newline at end of file
+def requests_session(pool_maxsize=16, retries=3):
+    """Creates `requests.Session` with connection pooling and retries.
+
+    Reusing one session keeps TCP/TLS connections alive across requests to the same host,
+    e.g. when paging through CBS OData or querying BAG for many addresses.
+
+    Args:
+        - pool_maxsize (int): maximum number of connections kept alive per host
+        - retries (int): number of retries on connection errors and 429/5xx responses
+
+    Returns:
+        requests.Session: session with retrying adapter mounted for http and https
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
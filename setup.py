@@ -10,7 +10,16 @@ with open("README.rst") as readme_file:
 with open("HISTORY.rst") as history_file:
     history = history_file.read()
 
-requirements = ["prefect>=0.11.0"]
+requirements = [
+    "deflate",
+    "google-cloud-bigquery",
+    "numba",
+    "numpy",
+    "orjson",
+    "prefect>=0.11.0",
+    "pyarrow>=14",
+    "python-calamine",
+]
 
 setup_requirements = [
     "pytest-runner",
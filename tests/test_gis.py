@@ -0,0 +1,199 @@
+"""Tests for `nimbletl.gis`."""
+
+import re
+
+import numpy as np
+import pytest
+
+from nimbletl import gis
+from nimbletl.gis import RDWGS84Converter
+
+
+RD_POINTS = [
+    (155000, 463000),
+    (121687, 487484),
+    (13000, 306000),
+    (278000, 621000),
+    (233883.131, 582065.167),
+]
+WGS84_POINTS = [
+    (52.15517440, 5.38720621),
+    (52.37403, 4.88969),
+    (50.75, 3.35),
+    (53.55, 7.25),
+]
+
+
+def sparse_sum(p, q, pq, u, v):
+    """Polynomial sum(pq[i] * u**p[i] * v**q[i]), as in the original formulas."""
+    return sum(c * u ** int(p[i]) * v ** int(q[i]) for i, c in enumerate(pq))
+
+
+def reference_from_rd(x, y):
+    c = RDWGS84Converter
+    dx = 1e-5 * (x - c.x0)
+    dy = 1e-5 * (y - c.y0)
+    return (
+        c.phi0 + sparse_sum(c.Kp, c.Kq, c.Kpq, dx, dy) / 3600,
+        c.lam0 + sparse_sum(c.Lp, c.Lq, c.Lpq, dx, dy) / 3600,
+    )
+
+
+def reference_from_wgs84(latitude, longitude):
+    c = RDWGS84Converter
+    dlat = 0.36 * (latitude - c.phi0)
+    dlon = 0.36 * (longitude - c.lam0)
+    return (
+        c.x0 + sparse_sum(c.Rp, c.Rq, c.Rpq, dlat, dlon),
+        c.y0 + sparse_sum(c.Sp, c.Sq, c.Spq, dlat, dlon),
+    )
+
+
+@pytest.mark.parametrize("x, y", RD_POINTS)
+def test_from_rd(x, y):
+    assert RDWGS84Converter().from_rd(x, y) == pytest.approx(
+        reference_from_rd(x, y), abs=1e-10
+    )
+
+
+@pytest.mark.parametrize("latitude, longitude", WGS84_POINTS)
+def test_from_wgs84(latitude, longitude):
+    assert RDWGS84Converter().from_wgs84(latitude, longitude) == pytest.approx(
+        reference_from_wgs84(latitude, longitude), abs=1e-6
+    )
+
+
+def test_from_rd_origin():
+    assert RDWGS84Converter().from_rd(155000, 463000) == pytest.approx(
+        (52.15517440, 5.38720621)
+    )
+
+
+def test_from_rd_array():
+    x, y = np.array(RD_POINTS, dtype=np.float64).T
+    latitude, longitude = RDWGS84Converter().from_rd_array(x, y)
+    expected = np.array([reference_from_rd(*point) for point in RD_POINTS])
+    np.testing.assert_allclose(latitude, expected[:, 0], atol=1e-10)
+    np.testing.assert_allclose(longitude, expected[:, 1], atol=1e-10)
+
+
+def test_from_wgs84_array():
+    latitude, longitude = np.array(WGS84_POINTS, dtype=np.float64).T
+    x, y = RDWGS84Converter().from_wgs84_array(latitude, longitude)
+    expected = np.array([reference_from_wgs84(*point) for point in WGS84_POINTS])
+    np.testing.assert_allclose(x, expected[:, 0], atol=1e-6)
+    np.testing.assert_allclose(y, expected[:, 1], atol=1e-6)
+
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.payload
+
+
+class FakeSession:
+    """Replies to BAG queries with `reply(params)`, recording the params of queries."""
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.queries = []
+
+    def get(self, url, params=None, timeout=None):
+        self.queries.append(params)
+        return FakeResponse(self.reply(params))
+
+
+@pytest.fixture
+def bag(monkeypatch):
+    """Installs a FakeSession for BAG queries, see `FakeSession`."""
+    gis._fetch_RDXY.cache_clear()
+
+    def install(reply):
+        session = FakeSession(reply)
+        monkeypatch.setattr(gis, "_SESSION", session)
+        return session
+
+    yield install
+    gis._fetch_RDXY.cache_clear()
+
+
+def test_get_RDXY_normalizes_and_caches(bag):
+    session = bag(lambda params: {"features": [{"geometry": {"x": 1.0, "y": 2.0}}]})
+
+    assert gis.get_RDXY("1234 ab", "5") == {"x": 1.0, "y": 2.0}
+    assert gis.get_RDXY("1234AB", 5) == {"x": 1.0, "y": 2.0}
+
+    assert len(session.queries) == 1
+    assert session.queries[0]["where"] == "huisnummer='5' AND postcode='1234AB'"
+
+
+def test_get_RDXY_not_found(bag):
+    bag(lambda params: {"features": []})
+
+    assert gis.get_RDXY("1234AB", 5) is None
+
+
+def test_get_RDXY_error_is_not_cached(bag):
+    replies = [
+        {"error": {"code": 429, "message": "Too many requests"}},
+        {"features": [{"geometry": {"x": 1.0, "y": 2.0}}]},
+    ]
+    bag(lambda params: replies.pop(0))
+
+    with pytest.raises(RuntimeError, match="BAG query failed"):
+        gis.get_RDXY("1234AB", 5)
+    assert gis.get_RDXY("1234AB", 5) == {"x": 1.0, "y": 2.0}
+
+
+def bag_features(params, limit=None):
+    """Features for every address in the where clause of BAG query params."""
+    addresses = re.findall(r"huisnummer='(\d+)' AND postcode='(\w+)'", params["where"])
+    features = [
+        {
+            "attributes": {"postcode": postcode, "huisnummer": int(huisnummer)},
+            "geometry": {"x": float(huisnummer), "y": 0.0},
+        }
+        for huisnummer, postcode in addresses
+        if huisnummer != "404"
+    ]
+    if limit is not None and len(addresses) > limit:
+        return {"features": features[:limit], "exceededTransferLimit": True}
+    return {"features": features}
+
+
+def test_get_RDXY_bulk(bag):
+    session = bag(bag_features)
+
+    result = gis.get_RDXY_bulk(
+        [("1234 ab", "1"), ("1234AB", 2), ("1234AB", 404), ("1234AB", 1)],
+        batch_size=2,
+    )
+
+    assert result == {
+        ("1234AB", 1): {"x": 1.0, "y": 0.0},
+        ("1234AB", 2): {"x": 2.0, "y": 0.0},
+        ("1234AB", 404): None,
+    }
+    assert len(session.queries) == 2
+    assert session.queries[0]["outFields"] == "postcode,huisnummer"
+
+
+def test_get_RDXY_bulk_splits_batches_over_limit(bag):
+    session = bag(lambda params: bag_features(params, limit=2))
+
+    result = gis.get_RDXY_bulk([("1234AB", i) for i in range(1, 6)], max_workers=1)
+
+    assert result == {("1234AB", i): {"x": float(i), "y": 0.0} for i in range(1, 6)}
+    assert len(session.queries) > 1
+
+
+def test_get_RDXY_bulk_error(bag):
+    bag(lambda params: {"error": {"code": 500, "message": "Internal error"}})
+
+    with pytest.raises(RuntimeError, match="BAG query failed"):
+        gis.get_RDXY_bulk([("1234AB", 1)])
@@ -0,0 +1,745 @@
+"""Tests for `nimbletl.tasks`."""
+
+import datetime
+import io
+import os
+import re
+from types import SimpleNamespace
+from zipfile import ZIP_BZIP2, ZIP_DEFLATED, ZIP_STORED, BadZipFile, ZipFile
+
+import prefect
+from prefect.engine.signals import SKIP
+import pyarrow as pa
+import pyarrow.fs
+import pyarrow.parquet as pq
+import pytest
+
+from nimbletl import tasks
+
+GCP = SimpleNamespace(project="project", bucket="bucket", location="EU")
+
+
+def make_zip(path, members):
+    """Writes zipfile at path with members {name: (data, compress_type)}."""
+    with ZipFile(path, "w") as zip:
+        for name, (data, compress_type) in members.items():
+            zip.writestr(name, data, compress_type=compress_type)
+    return path
+
+
+def corrupt_crc(path, name):
+    """Flips bits in the CRC-32 of member name in the central directory of zipfile."""
+    with ZipFile(path) as zip:
+        info = zip.getinfo(name)
+    data = bytearray(path.read_bytes())
+    # Central directory entries start with PK\1\2, the CRC-32 is at offset 16
+    start = 0
+    while True:
+        start = data.index(b"PK\x01\x02", start)
+        name_start = start + 46
+        name_length = int.from_bytes(data[start + 28:name_start - 16], "little")
+        if data[name_start:name_start + name_length].decode() == info.filename:
+            break
+        start += 1
+    data[start + 16] ^= 0xFF
+    path.write_bytes(bytes(data))
+
+
+@pytest.mark.parametrize(
+    "compress_type",
+    [ZIP_STORED, ZIP_DEFLATED, ZIP_BZIP2],
+    ids=["stored", "deflated", "bzip2"],
+)
+def test_unzip_members(tmp_path, compress_type):
+    data = os.urandom(100_000) + b"a" * 100_000
+    zipfile = make_zip(tmp_path / "data.zip", {"data.csv": (data, compress_type)})
+
+    files = tasks.unzip(zipfile)
+
+    assert files == [tmp_path / "data.csv"]
+    assert (tmp_path / "data.csv").read_bytes() == data
+
+
+def test_unzip_empty_member(tmp_path):
+    zipfile = make_zip(
+        tmp_path / "data.zip",
+        {"stored.csv": (b"", ZIP_STORED), "deflated.csv": (b"", ZIP_DEFLATED)},
+    )
+
+    tasks.unzip(zipfile)
+
+    assert (tmp_path / "stored.csv").read_bytes() == b""
+    assert (tmp_path / "deflated.csv").read_bytes() == b""
+
+
+def test_unzip_nested_directories(tmp_path):
+    zipfile = tmp_path / "data.zip"
+    with ZipFile(zipfile, "w") as zip:
+        zip.writestr("empty/", b"")
+        zip.writestr("a/b/c.csv", b"c" * 1000, compress_type=ZIP_DEFLATED)
+        zip.writestr("a/d.csv", b"d" * 1000, compress_type=ZIP_STORED)
+
+    files = tasks.unzip(zipfile)
+
+    assert files == [tmp_path / "a" / "b" / "c.csv", tmp_path / "a" / "d.csv"]
+    assert (tmp_path / "empty").is_dir()
+    assert (tmp_path / "a" / "b" / "c.csv").read_bytes() == b"c" * 1000
+    assert (tmp_path / "a" / "d.csv").read_bytes() == b"d" * 1000
+
+
+def test_unzip_returns_sanitized_paths(tmp_path):
+    zipfile = make_zip(
+        tmp_path / "data.zip", {"../outside.csv": (b"data", ZIP_DEFLATED)}
+    )
+
+    files = tasks.unzip(zipfile)
+
+    assert files == [tmp_path / "outside.csv"]
+    assert files[0].read_bytes() == b"data"
+    assert not (tmp_path.parent / "outside.csv").exists()
+
+
+def test_unzip_deflated_larger_than_oneshot(tmp_path, monkeypatch):
+    # Streaming zlib path, with output bounded per call and several reads per member
+    monkeypatch.setattr(tasks, "_INFLATE_ONESHOT_SIZE", 1024)
+    monkeypatch.setattr(tasks, "_COPY_BUFSIZE", 4096)
+    data = os.urandom(50_000) + b"\0" * 1_000_000
+    zipfile = make_zip(tmp_path / "data.zip", {"data.csv": (data, ZIP_DEFLATED)})
+
+    tasks.unzip(zipfile)
+
+    assert (tmp_path / "data.csv").read_bytes() == data
+
+
+def test_unzip_replaces_zipfile_with_empty_file(tmp_path):
+    zipfile = make_zip(tmp_path / "data.zip", {"data.csv": (b"data", ZIP_DEFLATED)})
+
+    tasks.unzip(zipfile)
+
+    assert zipfile.exists()
+    assert zipfile.stat().st_size == 0
+
+
+@pytest.mark.parametrize("oneshot_size", [1 << 20, 0], ids=["libdeflate", "zlib"])
+def test_unzip_deflated_bad_crc(tmp_path, monkeypatch, oneshot_size):
+    monkeypatch.setattr(tasks, "_INFLATE_ONESHOT_SIZE", oneshot_size)
+    data = b"data" * 1000
+    zipfile = make_zip(tmp_path / "data.zip", {"data.csv": (data, ZIP_DEFLATED)})
+    corrupt_crc(zipfile, "data.csv")
+
+    with pytest.raises(BadZipFile, match="CRC"):
+        tasks.unzip(zipfile)
+
+
+@pytest.mark.parametrize("copy_file_range", [True, False], ids=["kernel", "pread"])
+def test_unzip_stored_bad_crc(tmp_path, monkeypatch, copy_file_range):
+    if not copy_file_range:
+        monkeypatch.delattr(os, "copy_file_range", raising=False)
+    elif not hasattr(os, "copy_file_range"):
+        pytest.skip("no os.copy_file_range")
+    data = b"data" * 1000
+    zipfile = make_zip(tmp_path / "data.zip", {"data.csv": (data, ZIP_STORED)})
+    corrupt_crc(zipfile, "data.csv")
+
+    with pytest.raises(BadZipFile, match="CRC"):
+        tasks.unzip(zipfile)
+
+
+class Logger:
+    def info(self, message):
+        pass
+
+
+def test_odata_row_groups(monkeypatch):
+    pages = [
+        pa.Table.from_pylist([{"odata.type": "a", "Waarde": 1, "Leeg": None}] * 2),
+        pa.Table.from_pylist([]),
+        pa.Table.from_pylist([{"odata.type": "b", "Waarde": 1.5, "Leeg": None}] * 2),
+        pa.Table.from_pylist([{"odata.type": "c", "Waarde": None, "Leeg": "x"}]),
+    ]
+    monkeypatch.setattr(tasks, "odata_pages", lambda url: iter(pages))
+    monkeypatch.setattr(tasks, "_ROW_GROUP_ROWS", 4)
+
+    row_groups = list(tasks._odata_row_groups("url", "key", Logger()))
+
+    assert [t.num_rows for t in row_groups] == [4, 1]
+    expected = pa.schema(
+        [("odata_type", pa.string()), ("Waarde", pa.float64()), ("Leeg", pa.string())]
+    )
+    assert all(t.schema == expected for t in row_groups)
+    assert row_groups[1].to_pylist() == [
+        {"odata_type": "c", "Waarde": None, "Leeg": "x"}
+    ]
+
+
+def test_odata_row_groups_types(monkeypatch):
+    # Without the type, the first row group would fix Waarde to int64
+    pages = [
+        pa.Table.from_pylist([{"Waarde": 1}]),
+        pa.Table.from_pylist([{"Waarde": 1.5}]),
+    ]
+    monkeypatch.setattr(tasks, "odata_pages", lambda url: iter(pages))
+    monkeypatch.setattr(tasks, "_ROW_GROUP_ROWS", 1)
+
+    row_groups = list(
+        tasks._odata_row_groups("url", "key", Logger(), {"Waarde": pa.float64()})
+    )
+
+    assert [t.column("Waarde").to_pylist() for t in row_groups] == [[1.0], [1.5]]
+
+
+def test_odata_row_groups_bad_value(monkeypatch):
+    pages = [
+        pa.Table.from_pylist([{"Waarde": 1}]),
+        pa.Table.from_pylist([{"Waarde": 1.5}]),
+    ]
+    monkeypatch.setattr(tasks, "odata_pages", lambda url: iter(pages))
+    monkeypatch.setattr(tasks, "_ROW_GROUP_ROWS", 1)
+
+    with pytest.raises(pa.ArrowInvalid):
+        list(tasks._odata_row_groups("url", "key", Logger()))
+
+
+def test_upload_parquet(tmp_path):
+    row_groups = [pa.table({"a": [1, 2]}), pa.table({"a": [3]})]
+    path = tmp_path / "table.parquet"
+
+    assert tasks._upload_parquet(pa.fs.LocalFileSystem(), str(path), row_groups)
+
+    parquet_file = pq.ParquetFile(path)
+    assert parquet_file.metadata.num_row_groups == 2
+    assert parquet_file.read().column("a").to_pylist() == [1, 2, 3]
+
+
+def test_upload_parquet_without_rows(tmp_path):
+    path = tmp_path / "table.parquet"
+
+    assert not tasks._upload_parquet(pa.fs.LocalFileSystem(), str(path), iter([]))
+    assert not path.exists()
+
+
+class Credentials:
+    def __init__(self, valid):
+        self.valid = valid
+        self.token = "old-token"
+        self.expiry = datetime.datetime(2030, 1, 1)
+
+    def refresh(self, request):
+        self.valid = True
+        self.token = "new-token"
+
+
+@pytest.mark.parametrize("valid, token", [(True, "old-token"), (False, "new-token")])
+def test_gcs_filesystem_uses_credentials(monkeypatch, valid, token):
+    calls = []
+    monkeypatch.setattr(pa.fs, "GcsFileSystem", lambda **kwargs: calls.append(kwargs))
+
+    tasks._gcs_filesystem(Credentials(valid), "project")
+
+    assert calls == [
+        {
+            "access_token": token,
+            "credential_token_expiration": datetime.datetime(2030, 1, 1),
+            "project_id": "project",
+        }
+    ]
+
+
+class LoadJob:
+    def __init__(self, error=None):
+        self.error = error
+        self.waited = False
+
+    def result(self):
+        self.waited = True
+        if self.error:
+            raise self.error
+
+
+class BigQueryClient:
+    """Records loads of Parquet files, replying with `jobs` in order."""
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.loads = {}
+        self.deleted = []
+
+    def load_table_from_file(self, file, destination, **kwargs):
+        self.loads[destination] = pq.read_table(file)
+        return self.jobs.pop(0)
+
+    def delete_table(self, table, not_found_ok):
+        self.deleted.append(table)
+
+
+@pytest.fixture
+def cbs(monkeypatch):
+    """Serves a CBS data set with resources {key: pages}, see `BigQueryClient`."""
+
+    def install(resources, jobs):
+        client = BigQueryClient(jobs)
+        urls = {"TableInfos": [], "DataProperties": [], **resources}
+        monkeypatch.setattr(tasks.bigquery, "Client", lambda **kwargs: client)
+        value = [{"name": k, "url": k} for k in urls]
+        monkeypatch.setattr(tasks, "get_json", lambda url: {"value": value})
+        monkeypatch.setattr(tasks, "table_description", lambda url: "description")
+        monkeypatch.setattr(tasks, "fetch_data_properties", lambda url: [])
+        monkeypatch.setattr(
+            tasks, "odata_pages", lambda url: iter(urls[url.split("?")[0]])
+        )
+        return client
+
+    with prefect.context(logger=Logger()):
+        yield install
+
+
+def test_cbsodatav3_to_gbq(cbs):
+    jobs = [LoadJob()]
+    pages = [pa.table({"a": [1]}), pa.table({"a": [2]})]
+    client = cbs({"TypedDataSet": pages}, jobs[:])
+
+    result = tasks.cbsodatav3_to_gbq.run("83583NED", GCP=GCP)
+
+    assert result == jobs
+    assert jobs[0].waited
+    assert list(client.loads) == ["cbs.83583NED_TypedDataSet"]
+    assert client.loads["cbs.83583NED_TypedDataSet"].to_pylist() == [{"a": 1}, {"a": 2}]
+    assert client.deleted == ["cbs.83583NED_DataProperties"]
+
+
+def test_cbsodatav3_to_gbq_failed_load(cbs):
+    jobs = [LoadJob(error=RuntimeError("failed"))]
+    cbs({"TypedDataSet": [pa.table({"a": [1]})]}, jobs)
+
+    with pytest.raises(RuntimeError, match="failed"):
+        tasks.cbsodatav3_to_gbq.run("83583NED", GCP=GCP)
+
+
+@pytest.fixture
+def sheet(monkeypatch):
+    """Serves the first sheet of any workbook as rows, loading it into a mock client."""
+
+    def install(rows):
+        client = BigQueryClient([LoadJob()])
+        monkeypatch.setattr(tasks.bigquery, "Client", lambda **kwargs: client)
+        workbook = SimpleNamespace(
+            get_sheet_by_index=lambda index: SimpleNamespace(
+                iter_rows=lambda: iter(rows)
+            )
+        )
+        monkeypatch.setattr(
+            tasks, "CalamineWorkbook", SimpleNamespace(from_object=lambda io: workbook)
+        )
+        return client
+
+    return install
+
+
+def test_excel_to_gbq(sheet, monkeypatch):
+    monkeypatch.setattr(tasks, "_EXCEL_CHUNK_ROWS", 2)
+    client = sheet(
+        [
+            ["Regio's", "", "Aantal", "Bedrag", ""],
+            ["Amsterdam", "a", 1.0, 1.5, ""],
+            ["Utrecht", "", 2.0, 2.0, ""],
+            ["", "c", "", 3.0, ""],
+        ]
+    )
+
+    tasks.excel_to_gbq("data.xlsx", destination="dataset.table", GCP=GCP)
+
+    table = client.loads["dataset.table"]
+    assert table.column_names == [
+        "regio_s", "unnamed__1", "aantal", "bedrag", "unnamed__4"
+    ]
+    assert table.schema.types == [
+        pa.string(), pa.string(), pa.int64(), pa.float64(), pa.string()
+    ]
+    assert table.column("aantal").to_pylist() == [1, 2, None]
+
+
+def test_excel_to_gbq_duplicate_columns(sheet):
+    sheet([["Aantal", "aantal "], [1.0, 2.0]])
+
+    with pytest.raises(ValueError, match="aantal"):
+        tasks.excel_to_gbq("data.xlsx", destination="dataset.table", GCP=GCP)
+
+
+def test_excel_to_gbq_header_only(sheet):
+    client = sheet([["Naam", "Aantal"]])
+
+    tasks.excel_to_gbq("data.xlsx", destination="dataset.table", GCP=GCP)
+
+    table = client.loads["dataset.table"]
+    assert table.num_rows == 0
+    assert table.schema == pa.schema([("naam", pa.string()), ("aantal", pa.string())])
+
+
+def test_narrow_integral():
+    table = pa.table(
+        {
+            "integral": [1.0, None, -3.0],
+            "fraction": [1.0, 2.5, 3.0],
+            "too_large": [1.0, 2.0 ** 63, 3.0],
+            "empty": pa.array([None, None, None], pa.float64()),
+            "text": ["a", "b", "c"],
+        }
+    )
+
+    narrowed = tasks._narrow_integral(table)
+
+    assert narrowed.schema.types == [
+        pa.int64(), pa.float64(), pa.float64(), pa.float64(), pa.string()
+    ]
+    assert narrowed.column("integral").to_pylist() == [1, None, -3]
+
+
+class FailingReader:
+    """Binary file that returns chunks of data and then raises."""
+
+    def __init__(self, *chunks):
+        self.chunks = list(chunks)
+
+    def read(self, size):
+        chunk = self.chunks.pop(0)
+        if isinstance(chunk, Exception):
+            raise chunk
+        return chunk
+
+
+def test_zip_member_reader_error_is_raised_on_every_read():
+    with tasks._ZipMemberReader(FailingReader(b"data", OSError("bad data"))) as reader:
+        assert reader.read(4) == b"data"
+        with pytest.raises(OSError, match="bad data"):
+            reader.read(4)
+        with pytest.raises(OSError, match="bad data"):
+            reader.read(4)
+
+
+def test_zip_member_reader_fills_buffer(monkeypatch):
+    monkeypatch.setattr(tasks, "_COPY_BUFSIZE", 3)
+    data = b"0123456789"
+
+    with tasks._ZipMemberReader(io.BytesIO(data), prefetch=1) as reader:
+        assert reader.read(4) == b"0123"
+        assert reader.tell() == 4
+        assert reader.read() == b"456789"
+        assert reader.read(4) == b""
+        assert reader.tell() == len(data)
+
+
+def test_zip_member_reader_close_before_end(monkeypatch):
+    monkeypatch.setattr(tasks, "_COPY_BUFSIZE", 1)
+
+    reader = tasks._ZipMemberReader(io.BytesIO(b"0123456789"), prefetch=1)
+    assert reader.read(1) == b"0"
+    reader.close()
+
+    # The prefetch thread stops on close, even though the queue is full
+    assert not reader._thread.is_alive()
+    assert reader.closed
+
+
+def test_zip_member_to_gbq(tmp_path, monkeypatch):
+    data = b"a,b\n" + b"1,2\n" * 10_000
+    zipfile = make_zip(tmp_path / "data.zip", {"data.csv": (data, ZIP_DEFLATED)})
+    loads = []
+
+    def load_table_from_file(file, destination, size, job_config, **kwargs):
+        loads.append((destination, size, job_config, file.read(), file.tell()))
+        return LoadJob()
+
+    client = SimpleNamespace(load_table_from_file=load_table_from_file)
+    monkeypatch.setattr(tasks.bigquery, "Client", lambda **kwargs: client)
+
+    tasks.zip_member_to_gbq(zipfile, "data.csv", destination="dataset.table", GCP=GCP)
+
+    [(destination, size, job_config, uploaded, position)] = loads
+    assert (destination, size, uploaded, position) == (
+        "dataset.table", len(data), data, len(data)
+    )
+    assert job_config.skip_leading_rows == 1
+    assert job_config.write_disposition == "WRITE_TRUNCATE"
+
+
+def test_zip_member_to_gbq_missing_member(tmp_path, monkeypatch):
+    zipfile = make_zip(tmp_path / "data.zip", {"data.csv": (b"a\n", ZIP_DEFLATED)})
+    monkeypatch.setattr(tasks.bigquery, "Client", lambda **kwargs: None)
+
+    with pytest.raises(KeyError):
+        tasks.zip_member_to_gbq(zipfile, "other.csv", destination="d.t", GCP=GCP)
+
+
+class DownloadResponse:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for chunk in self.chunks:
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+
+@pytest.fixture
+def downloads(monkeypatch):
+    """Serves urls from {url: chunks}, recording the requested urls."""
+
+    def install(files):
+        requested = []
+
+        def get(url, stream, timeout):
+            requested.append(url)
+            return DownloadResponse(files[url])
+
+        monkeypatch.setattr(tasks, "_SESSION", SimpleNamespace(get=get))
+        return requested
+
+    return install
+
+
+def test_download(tmp_path, downloads):
+    requested = downloads({"https://a": [b"a", b"b"], "https://b": [b"c"]})
+    (tmp_path / "b.csv").write_bytes(b"old")
+
+    files = tasks.download.run(
+        ["https://a", "https://b"], [tmp_path / "a.csv", tmp_path / "b.csv"]
+    )
+
+    assert files == [tmp_path / "a.csv"]
+    assert requested == ["https://a"]
+    assert (tmp_path / "a.csv").read_bytes() == b"ab"
+    assert (tmp_path / "b.csv").read_bytes() == b"old"
+
+
+def test_download_all_exist(tmp_path, downloads):
+    downloads({})
+    (tmp_path / "a.csv").write_bytes(b"old")
+
+    with pytest.raises(SKIP):
+        tasks.download.run(["https://a"], [tmp_path / "a.csv"])
+
+
+def test_download_failure_removes_partial_file(tmp_path, downloads):
+    downloads({"https://a": [b"a", ConnectionError("reset")]})
+
+    with pytest.raises(ConnectionError):
+        tasks.download.run(["https://a"], [tmp_path / "a.csv"])
+
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_curl_cmd(tmp_path):
+    filepath = tmp_path / "a.csv"
+
+    assert tasks.curl_cmd.run("https://a", filepath) == (
+        f"curl -fL -o {filepath} https://a"
+    )
+
+
+def test_curl_cmd_skips_existing_file(tmp_path):
+    filepath = tmp_path / "a.csv"
+    filepath.write_bytes(b"old")
+
+    with pytest.raises(SKIP):
+        tasks.curl_cmd.run("https://a", filepath)
+
+
+def test_curl_cmd_conditional(tmp_path):
+    filepath = tmp_path / "a.csv"
+    filepath.write_bytes(b"old")
+    (tmp_path / "a.csv.etag").write_text('"etag"')
+
+    assert tasks.curl_cmd.run("https://a", filepath, conditional=True) == (
+        f"curl -fL --etag-save {filepath}.etag -z {filepath} "
+        f"--etag-compare {filepath}.etag -o {filepath} https://a"
+    )
+
+
+def test_curl_many_cmd(tmp_path):
+    (tmp_path / "b.csv").write_bytes(b"old")
+
+    command = tasks.curl_many_cmd.run(
+        ["https://a", "https://b", "https://c"],
+        [tmp_path / "a.csv", tmp_path / "b.csv", tmp_path / "c.csv"],
+        parallel_max=2,
+    )
+
+    assert command == (
+        f"curl --parallel --parallel-max 2 -fL -o {tmp_path / 'a.csv'} https://a"
+        f" --next -fL -o {tmp_path / 'c.csv'} https://c"
+    )
+
+
+def test_curl_many_cmd_all_exist(tmp_path):
+    (tmp_path / "a.csv").write_bytes(b"old")
+
+    with pytest.raises(SKIP):
+        tasks.curl_many_cmd.run(["https://a"], [tmp_path / "a.csv"])
+
+
+def test_curl_cmd_without_existence_check(tmp_path):
+    filepath = tmp_path / "a.csv"
+    filepath.write_bytes(b"old")
+
+    assert tasks.curl_cmd.run("https://a", filepath, skip_if_exists=False) == (
+        f"curl -fL -o {filepath} https://a"
+    )
+
+
+def odata_server(rows, limit, count=True):
+    """get_json for an OData resource with rows, returning at most limit per request."""
+    requested = []
+
+    def get_json(url):
+        requested.append(url)
+        params = dict(re.findall(r"\$(\w+)=(\w+)", url))
+        if params.get("inlinecount"):
+            return {"odata.count": str(len(rows))} if count else {}
+        skip = int(params.get("skip", 0))
+        top = int(params.get("top", len(rows)))
+        end = min(skip + top, len(rows))
+        page = {"value": rows[skip:min(end, skip + limit)]}
+        if skip + limit < end:
+            page["odata.nextLink"] = (
+                f"resource?$format=json&$skip={skip + limit}&$top={end - skip - limit}"
+            )
+        return page
+
+    return get_json, requested
+
+
+@pytest.mark.parametrize("limit", [10, 3], ids=["pages", "server-limit"])
+def test_odata_pages(monkeypatch, limit):
+    rows = [{"ID": i} for i in range(25)]
+    get_json, requested = odata_server(rows, limit)
+    monkeypatch.setattr(tasks, "get_json", get_json)
+
+    pages = list(
+        tasks.odata_pages("resource?$format=json", page_size=10, max_workers=2)
+    )
+
+    assert [page.num_rows for page in pages] == [10, 10, 5]
+    assert [row for page in pages for row in page.to_pylist()] == rows
+    assert "resource?$format=json&$skip=20&$top=10" in requested
+
+
+def test_odata_pages_without_count(monkeypatch):
+    rows = [{"ID": i} for i in range(25)]
+    get_json, requested = odata_server(rows, limit=10, count=False)
+    monkeypatch.setattr(tasks, "get_json", get_json)
+
+    pages = list(tasks.odata_pages("resource?$format=json", page_size=10))
+
+    # Followed sequentially through odata.nextLink, as a single page
+    assert [row for page in pages for row in page.to_pylist()] == rows
+    assert len(requested) == 4
+
+
+def test_odata_pages_promotes_types_across_next_links(monkeypatch):
+    rows = [{"Waarde": None}, {"Waarde": 1}, {"Waarde": 1.5}]
+    get_json, _ = odata_server(rows, limit=1)
+    monkeypatch.setattr(tasks, "get_json", get_json)
+
+    [page] = tasks.odata_pages("resource?$format=json", page_size=10)
+
+    assert page.schema.field("Waarde").type == pa.float64()
+    assert page.column("Waarde").to_pylist() == [None, 1.0, 1.5]
+
+
+class UriClient:
+    """Records data sets, deletes and loads from GCS, failing the `failing` tables."""
+
+    def __init__(self, failing=()):
+        self.project = "project"
+        self.failing = failing
+        self.datasets = []
+        self.deleted = []
+        self.loads = []
+
+    def create_dataset(self, dataset, exists_ok):
+        self.datasets.append(dataset.dataset_id)
+
+    def delete_table(self, table, not_found_ok):
+        self.deleted.append(table)
+
+    def load_table_from_uri(self, uri, destination, project, job_config):
+        self.loads.append((uri, destination, job_config.destination_table_description))
+        if destination in self.failing:
+            return LoadJob(RuntimeError(f"{destination} failed"))
+        return LoadJob()
+
+
+def test_gcs_to_bq(monkeypatch):
+    client = UriClient()
+    monkeypatch.setattr(tasks.bigquery, "Client", lambda **kwargs: client)
+    files = {
+        "cbs.83583NED_TypedDataSet.parquet",
+        "cbs.83583NED_DataProperties.parquet",
+    }
+
+    with prefect.context(logger=Logger()):
+        tasks.gcs_to_bq.run((files, "description"), GCP=GCP)
+
+    assert client.datasets == ["cbs"]
+    assert sorted(client.deleted) == [
+        "cbs.83583NED_DataProperties", "cbs.83583NED_TypedDataSet"
+    ]
+    assert sorted(client.loads) == [
+        (
+            "gs://bucket/cbs.83583NED_DataProperties.parquet",
+            "cbs.83583NED_DataProperties",
+            "description",
+        ),
+        (
+            "gs://bucket/cbs.83583NED_TypedDataSet.parquet",
+            "cbs.83583NED_TypedDataSet",
+            "description",
+        ),
+    ]
+
+
+def test_gcs_to_bq_failed_load(monkeypatch):
+    client = UriClient(failing=["cbs.83583NED_TypedDataSet"])
+    monkeypatch.setattr(tasks.bigquery, "Client", lambda **kwargs: client)
+    files = {"cbs.83583NED_TypedDataSet.parquet"}
+
+    with prefect.context(logger=Logger()), pytest.raises(RuntimeError, match="failed"):
+        tasks.gcs_to_bq.run((files, "description"), GCP=GCP)
+
+
+@pytest.mark.parametrize("max_uploads", [1, 2])
+def test_cbsodatav3_to_gcs(cbs, tmp_path, monkeypatch, max_uploads):
+    (tmp_path / "bucket").mkdir()
+    gcs = pa.fs.SubTreeFileSystem(str(tmp_path), pa.fs.LocalFileSystem())
+    monkeypatch.setattr(tasks, "_gcs_filesystem", lambda credentials, project: gcs)
+    cbs(
+        {
+            "TypedDataSet": [pa.table({"a": [1]}), pa.table({"a": [2]})],
+            "Perioden": [pa.table({"Key": ["2020JJ00"]})],
+            "CategoryGroups": [],
+        },
+        [],
+    )
+
+    files, description = tasks.cbsodatav3_to_gcs.run(
+        "83583NED", GCP=GCP, max_uploads=max_uploads
+    )
+
+    assert description == "description"
+    assert files == {
+        "cbs.83583NED_TypedDataSet.parquet",
+        "cbs.83583NED_Perioden.parquet",
+    }
+    assert sorted(p.name for p in (tmp_path / "bucket").iterdir()) == sorted(files)
+    typed = pq.read_table(tmp_path / "bucket" / "cbs.83583NED_TypedDataSet.parquet")
+    assert typed.column("a").to_pylist() == [1, 2]
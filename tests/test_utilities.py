@@ -0,0 +1,51 @@
+"""Tests for `nimbletl.utilities`."""
+
+import re
+
+import pytest
+
+from nimbletl.utilities import clean_python_name, clean_python_names
+
+
+def reference_clean_python_name(s):
+    """The original implementation, with a regex substitution per step."""
+    s = re.sub("^[^a-zA-Z_]+", "", s.strip())
+    s = re.sub("[^0-9a-zA-Z_]", "_", s)
+    return s.lower()
+
+
+NAMES = [
+    "",
+    "   ",
+    "Name",
+    "  Regio's  ",
+    "2020 Totaal (x 1 000)",
+    "_private",
+    "ID",
+    "Perioden/Jaar",
+    "Bevolking.Mannen",
+    "Één-oudergezin",
+    "ß ü ñ ÿ",
+    "Temperatuur °C",
+    "€ bedrag",
+    "日本語 column",
+    "tab\tand\nnewline",
+    " non-breaking space",
+]
+
+
+@pytest.mark.parametrize("name", NAMES)
+def test_clean_python_name_matches_reference(name):
+    assert clean_python_name(name) == reference_clean_python_name(name)
+
+
+def test_clean_python_name_all_latin1_characters():
+    name = "a" + "".join(map(chr, range(256)))
+    assert clean_python_name(name) == reference_clean_python_name(name)
+
+
+def test_clean_python_names():
+    names = ["Regio's", "2020 Totaal", "ID"]
+
+    assert clean_python_names(iter(names)) == [clean_python_name(n) for n in names]
+    assert clean_python_names([]) == []